@@ -1,16 +1,10 @@
 from __future__ import annotations
 
-import os
-from typing import Dict, List
-
-import requests
 import streamlit as st
-from dotenv import load_dotenv
-
-load_dotenv()
 
-API_MODEL = "gemini-2.5-pro"
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{API_MODEL}:generateContent"
+from chat_store import browser_session_id, clear_messages, load_messages, save_message
+from chat_ui import render_history
+from gemini_client import API_MODEL, ENV_API_KEY, MAX_TURNS, MODEL_OPTIONS, generate_response
 
 PERSONAS = {
     "뉴욕 핫도그 가게 주인": (
@@ -25,7 +19,19 @@ PERSONAS = {
     ),
 }
 
+GREETING = {
+    "role": "assistant",
+    "content": "안녕하세요! 두려움 없이 영어를 연습할 수 있도록 도와줄게요. 준비가 되면 영어로 말해보세요!",
+}
 
+DEFAULT_MISSIONS = {
+    "뉴욕 핫도그 가게 주인": "Order a hot dog without ketchup and ask for the price.",
+    "길 잃은 관광객": "Ask how to get to the library from the subway station.",
+    "미래형 학교 로봇": "Request classroom materials politely and ask for homework help.",
+}
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
 def build_system_prompt(persona_label: str, mission: str, feedback_mode: bool) -> str:
     persona_instruction = PERSONAS.get(persona_label, "")
     feedback_instruction = (
@@ -44,64 +50,34 @@ def build_system_prompt(persona_label: str, mission: str, feedback_mode: bool) -
     )
 
 
-def build_contents(messages: List[Dict[str, str]], system_prompt: str) -> List[Dict[str, object]]:
-    """Convert local chat history into the format expected by Gemini."""
-    contents: List[Dict[str, object]] = [{"role": "user", "parts": [{"text": system_prompt}]}]
-    for message in messages:
-        role = "user" if message["role"] == "user" else "model"
-        contents.append({"role": role, "parts": [{"text": message["content"]}]})
-    return contents
-
-
-def get_api_key() -> str | None:
-    """Return the active API key from session state or fallback to env."""
-    session_key = st.session_state.get("api_key")
-    if session_key:
-        return session_key.strip()
-    return os.getenv("GOOGLE_API_KEY")
-
-
-def generate_response(messages: List[Dict[str, str]], system_prompt: str) -> str:
-    """Call the Gemini API and return the assistant text."""
-    api_key = get_api_key()
-    if not api_key:
-        raise RuntimeError("API 키가 설정되지 않았습니다. 사이드바에서 입력하거나 .env 파일을 업데이트하세요.")
-
-    payload = {"contents": build_contents(messages, system_prompt)}
-    params = {"key": api_key}
-    response = requests.post(API_URL, params=params, json=payload, timeout=30)
-
-    if not response.ok:
-        raise RuntimeError(f"Gemini API error: {response.status_code} {response.text}")
-
-    data = response.json()
-    try:
-        candidates = data["candidates"]
-        parts = candidates[0]["content"]["parts"]
-        text = "\n".join(part.get("text", "") for part in parts).strip()
-        if not text:
-            raise ValueError("Empty response received.")
-        return text
-    except (KeyError, IndexError, ValueError) as exc:
-        raise RuntimeError(f"Unexpected Gemini payload: {data}") from exc
-
-
 st.set_page_config(page_title="두려움 없는 AI 영어 친구", page_icon="🗽", layout="centered")
 st.title("두려움 없는 AI 영어 친구")
 st.caption("초등 고학년 Pre-Speaking 리허설")
 
+session_id = browser_session_id()
+
 if "messages" not in st.session_state:
-    st.session_state.messages = [
-        {
-            "role": "assistant",
-            "content": "안녕하세요! 두려움 없이 영어를 연습할 수 있도록 도와줄게요. 준비가 되면 영어로 말해보세요!",
-        }
-    ]
+    st.session_state.messages = [dict(GREETING), *(load_messages(session_id) if session_id else [])]
+
+
+def start_new_chat() -> None:
+    """Forget this browser's stored history and start over from the greeting."""
+    if session_id:
+        clear_messages(session_id)
+    st.session_state.messages = [dict(GREETING)]
+
 
 with st.sidebar:
+    st.button(
+        "새 대화",
+        on_click=start_new_chat,
+        use_container_width=True,
+        help="저장된 대화를 지우고 처음부터 다시 시작합니다. 다른 친구에게 넘겨주기 전에 눌러주세요.",
+    )
+
     st.header("환경 설정")
     if "api_key" not in st.session_state:
-        st.session_state.api_key = os.getenv("GOOGLE_API_KEY", "")
+        st.session_state.api_key = ENV_API_KEY
     if "show_api_key" not in st.session_state:
         st.session_state.show_api_key = False
 
@@ -117,51 +93,75 @@ with st.sidebar:
     )
     st.session_state.api_key = api_key_input
 
+    model_choice = st.radio(
+        "모델 속도",
+        list(MODEL_OPTIONS.keys()),
+        index=list(MODEL_OPTIONS.values()).index(API_MODEL),
+        horizontal=True,
+        help="flash-lite가 가장 빠르고, pro는 느리지만 더 정교합니다.",
+    )
+
     st.divider()
     st.subheader("페르소나")
     persona_choice = st.selectbox("챗봇 역할", list(PERSONAS.keys()))
 
     st.subheader("미션")
-    default_missions = {
-        "뉴욕 핫도그 가게 주인": "Order a hot dog without ketchup and ask for the price.",
-        "길 잃은 관광객": "Ask how to get to the library from the subway station.",
-        "미래형 학교 로봇": "Request classroom materials politely and ask for homework help.",
-    }
     mission_text = st.text_area(
         "학생 미션",
-        value=default_missions.get(persona_choice, ""),
+        value=DEFAULT_MISSIONS.get(persona_choice, ""),
         placeholder="예) Ask the owner to remove ketchup.",
         height=80,
     )
 
     feedback_mode = st.checkbox("친절한 피드백 포함", value=True, help="답변 끝에 짧은 'Friendly Tip'을 보여줍니다.")
+    max_turns = st.slider(
+        "대화 기억 길이",
+        min_value=2,
+        max_value=50,
+        value=MAX_TURNS,
+        help="AI에게 함께 보내는 최근 메시지 수입니다. 짧을수록 답변이 빨라집니다.",
+    )
 
     st.caption("`.env`에 키를 저장하거나 위 입력창에 붙여넣어 사용할 수 있습니다.")
 
 st.info(f"🎯 오늘의 미션: **{mission_text.strip() or '자신 있게 영어로 말해보기'}**")
 st.success(f"🤖 챗봇 페르소나: **{persona_choice}**")
 
-for message in st.session_state.messages:
-    role = "assistant" if message["role"] == "assistant" else "user"
-    with st.chat_message(role):
-        st.markdown(message["content"])
+render_history()
 
 prompt = st.chat_input("미션을 따라 영어로 말해보세요!")
 
 if prompt:
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    user_message = {"role": "user", "content": prompt}
+    st.session_state.messages.append(user_message)
+    if session_id:
+        save_message(session_id, user_message)
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    with st.spinner("AI 친구가 생각하는 중..."):
-        try:
-            system_prompt = build_system_prompt(persona_choice, mission_text, feedback_mode)
-            reply = generate_response(st.session_state.messages, system_prompt)
-        except Exception as error:  # noqa: BLE001
-            st.error(str(error))
-        else:
-            st.session_state.messages.append({"role": "assistant", "content": reply})
-            with st.chat_message("assistant"):
-                st.markdown(reply)
-
-
+    try:
+        system_prompt = build_system_prompt(persona_choice, mission_text, feedback_mode)
+        with st.chat_message("assistant"):
+            status_slot = st.empty()
+            status = status_slot.status("AI 친구가 생각하는 중...")
+            placeholder = st.empty()
+            try:
+                reply = placeholder.write_stream(
+                    generate_response(
+                        st.session_state.messages,
+                        system_prompt,
+                        max_turns,
+                        MODEL_OPTIONS[model_choice],
+                        on_wait=lambda elapsed: status.update(label=f"AI 친구가 생각하는 중... {elapsed:.1f}s"),
+                        on_first_chunk=status_slot.empty,
+                    )
+                )
+            finally:
+                status_slot.empty()
+    except Exception as error:  # noqa: BLE001
+        st.error(str(error))
+    else:
+        assistant_message = {"role": "assistant", "content": reply}
+        st.session_state.messages.append(assistant_message)
+        if session_id:
+            save_message(session_id, assistant_message)
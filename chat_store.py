@@ -0,0 +1,76 @@
+"""SQLite persistence for chat history."""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import streamlit as st
+
+CHAT_DB_PATH = "chat.db"
+XSRF_COOKIE = "_streamlit_xsrf"
+
+# One connection is shared by every session thread, so serialize access to it.
+_DB_LOCK = threading.Lock()
+
+
+def _xsrf_token(cookie: str) -> bytes:
+    """Unmask Streamlit's (Tornado) XSRF cookie into its stable per-browser token."""
+    cookie = cookie.strip('"')
+    parts = cookie.split("|")
+    try:
+        if len(parts) == 4 and parts[0] == "2":
+            mask, masked = bytes.fromhex(parts[1]), bytes.fromhex(parts[2])
+            return bytes(byte ^ mask[i % len(mask)] for i, byte in enumerate(masked))
+        return bytes.fromhex(cookie)
+    except ValueError:
+        return b""
+
+
+def browser_session_id() -> str | None:
+    """Return the history key for this browser, or ``None`` if there is none.
+
+    The key is derived from Streamlit's per-browser XSRF cookie, so it never
+    appears in (or can be adopted from) a shared URL. Without that cookie there
+    is no stable key and history should not be persisted.
+    """
+    token = _xsrf_token(st.context.cookies.get(XSRF_COOKIE, ""))
+    if not token:
+        return None
+    return hashlib.sha256(b"chat-history:" + token).hexdigest()
+
+
+@st.cache_resource
+def get_chat_db() -> sqlite3.Connection:
+    """Open the shared SQLite store that keeps chat history across refreshes."""
+    connection = sqlite3.connect(CHAT_DB_PATH, check_same_thread=False)
+    connection.execute("CREATE TABLE IF NOT EXISTS msg(session TEXT, ts REAL, role TEXT, content TEXT)")
+    connection.execute("CREATE INDEX IF NOT EXISTS msg_session_ts ON msg(session, ts)")
+    return connection
+
+
+def load_messages(session_id: str) -> List[Dict[str, str]]:
+    """Return the stored chat history for ``session_id`` in order."""
+    with _DB_LOCK:
+        rows = get_chat_db().execute(
+            "SELECT role, content FROM msg WHERE session = ? ORDER BY ts", (session_id,)
+        ).fetchall()
+    return [{"role": role, "content": content} for role, content in rows]
+
+
+def save_message(session_id: str, message: Dict[str, str]) -> None:
+    """Append one chat message to the persistent history."""
+    with _DB_LOCK, get_chat_db() as connection:
+        connection.execute(
+            "INSERT INTO msg(session, ts, role, content) VALUES (?, ?, ?, ?)",
+            (session_id, time.time(), message["role"], message["content"]),
+        )
+
+
+def clear_messages(session_id: str) -> None:
+    """Delete the stored chat history for ``session_id``."""
+    with _DB_LOCK, get_chat_db() as connection:
+        connection.execute("DELETE FROM msg WHERE session = ?", (session_id,))
@@ -0,0 +1,13 @@
+"""Chat history rendering."""
+
+from __future__ import annotations
+
+import streamlit as st
+
+
+def render_history() -> None:
+    """Render every stored turn as its own chat bubble."""
+    for message in st.session_state.messages:
+        role = "assistant" if message["role"] == "assistant" else "user"
+        with st.chat_message(role):
+            st.markdown(message["content"])
@@ -0,0 +1,343 @@
+"""Gemini API client: payload building, caching and streamed replies."""
+
+from __future__ import annotations
+
+import functools
+import gzip
+import hashlib
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import httpx
+import orjson
+import streamlit as st
+from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import ScriptRunContext, add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+load_dotenv()
+ENV_API_KEY = os.getenv("GOOGLE_API_KEY", "")
+
+API_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+API_MODEL = "gemini-2.5-flash"
+MODEL_OPTIONS = {
+    "flash-lite": "gemini-2.5-flash-lite",
+    "flash": "gemini-2.5-flash",
+    "pro": "gemini-2.5-pro",
+}
+CACHE_API_PATH = "/cachedContents"
+CACHE_TTL_SECONDS = 3600
+# Gemini rejects cached contents below a per-model token floor.
+CACHE_MIN_TOKENS = {"gemini-2.5-pro": 4096}
+CACHE_MIN_TOKENS_DEFAULT = 1024
+# Rough English-text ratio; only used to skip registrations that cannot succeed.
+CHARS_PER_TOKEN = 4
+MAX_TURNS = 12
+REPLY_CACHE_TTL_SECONDS = 600
+REPLY_CACHE_MAX_ENTRIES = 128
+RETRY_ATTEMPTS = 2
+RETRY_BACKOFF_SECONDS = 0.3
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Each worker holds one reply for its whole duration, so size for a full classroom.
+WORKER_POOL_SIZE = 64
+GZIP_MIN_BYTES = 1024
+WAIT_POLL_SECONDS = 0.1
+# Upper bound on the wait for the first chunk, including time queued for a pool worker.
+STREAM_DEADLINE_SECONDS = 180
+
+_STREAM_DONE = object()
+_ROLE_MAP = {"user": "user", "assistant": "model"}
+
+# Shared HTTP/2 client so every turn multiplexes over one TLS connection to Gemini.
+CLIENT = httpx.Client(
+    base_url=API_BASE_URL,
+    timeout=httpx.Timeout(30, connect=5),
+    transport=httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=8),
+        retries=RETRY_ATTEMPTS,
+    ),
+    headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"},
+)
+
+
+def system_entry(system_prompt: str) -> Dict[str, object]:
+    """Wrap the system prompt as the leading user turn Gemini expects."""
+    return {"role": "user", "parts": [{"text": system_prompt}]}
+
+
+def build_contents(
+    messages: List[Dict[str, str]], system_prompt: str | None, max_turns: int = MAX_TURNS
+) -> List[Dict[str, object]]:
+    """Convert local chat history into the format expected by Gemini.
+
+    Only the opening greeting and (at most) the last ``max_turns`` messages are
+    sent so the per-turn payload stays bounded. Pass ``system_prompt=None`` when the prompt
+    already lives in a cached content.
+    """
+    total = len(messages)
+    start = max(total - max_turns, 0)
+    # Open the window on a user turn so it doesn't follow the greeting with a second model turn.
+    if start and start < total and messages[start]["role"] == "assistant":
+        start += 1
+    indices: Iterable[int] = range(start, total)
+    if start:
+        indices = itertools.chain((0,), indices)
+    offset = 1 if system_prompt else 0
+    # Size the list up front instead of copying a sliced history and growing it.
+    contents: List[Dict[str, object]] = [None] * (offset + (1 if start else 0) + total - start)  # type: ignore[list-item]
+    if system_prompt:
+        contents[0] = system_entry(system_prompt)
+    for position, index in enumerate(indices, offset):
+        message = messages[index]
+        contents[position] = {"role": _ROLE_MAP[message["role"]], "parts": [{"text": message["content"]}]}
+    return contents
+
+
+def is_cacheable(system_prompt: str, model: str) -> bool:
+    """Return whether ``system_prompt`` is large enough to register as cached content."""
+    min_tokens = CACHE_MIN_TOKENS.get(model, CACHE_MIN_TOKENS_DEFAULT)
+    return len(system_prompt) // CHARS_PER_TOKEN >= min_tokens
+
+
+# Refresh well before the server-side TTL so we never reference an expired cache.
+@st.cache_resource(ttl=CACHE_TTL_SECONDS - 600, show_spinner=False)
+def get_cached_persona(system_prompt: str, model: str, api_key_hash: str, _api_key: str) -> str | None:
+    """Register the system prompt with Gemini context caching and return its name.
+
+    Callers should check :func:`is_cacheable` first. Returns ``None`` when the
+    registration fails so callers can fall back to inline prompts.
+    """
+    payload = {
+        "model": f"models/{model}",
+        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "ttl": f"{CACHE_TTL_SECONDS}s",
+    }
+    try:
+        response = CLIENT.post(CACHE_API_PATH, params={"key": _api_key}, content=orjson.dumps(payload))
+    except httpx.HTTPError:
+        return None
+    if response.is_error:
+        return None
+    return orjson.loads(response.content).get("name")
+
+
+def hash_api_key(api_key: str) -> str:
+    """Return a stable digest so the raw key never becomes a cache key."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+ReplyKey = Tuple[Tuple[Tuple[str, str], ...], str, int, str, str]
+
+
+class ReplyCache:
+    """Process-wide TTL cache of finished replies keyed on the exact request."""
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[ReplyKey, Tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: ReplyKey) -> str | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, reply = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return reply
+
+    def put(self, key: ReplyKey, reply: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@st.cache_resource
+def get_reply_cache() -> ReplyCache:
+    """Share one reply cache across every session served by this process."""
+    return ReplyCache(REPLY_CACHE_TTL_SECONDS, REPLY_CACHE_MAX_ENTRIES)
+
+
+def get_api_key() -> str | None:
+    """Return the active API key from session state or fallback to env."""
+    session_key = st.session_state.get("api_key")
+    return session_key.strip() if session_key else (ENV_API_KEY or None)
+
+
+def encode_body(payload: Dict[str, object]) -> Tuple[bytes, Dict[str, str]]:
+    """Serialize ``payload`` and gzip it once it is large enough to be worth it."""
+    body = orjson.dumps(payload)
+    if len(body) < GZIP_MIN_BYTES:
+        return body, {}
+    return gzip.compress(body, compresslevel=1), {"Content-Encoding": "gzip"}
+
+
+@functools.lru_cache(maxsize=8)
+def model_path(model: str, streaming: bool) -> str:
+    """Return the (base-URL relative) generate endpoint for ``model``."""
+    method = "streamGenerateContent" if streaming else "generateContent"
+    return f"/models/{model}:{method}"
+
+
+def _stream_gemini(
+    messages: List[Dict[str, str]], system_prompt: str, api_key: str, max_turns: int, model: str
+) -> Iterator[str]:
+    """Call the streaming Gemini endpoint and yield text chunks as they arrive."""
+    cache_name = None
+    if is_cacheable(system_prompt, model):
+        cache_name = get_cached_persona(system_prompt, model, hash_api_key(api_key), api_key)
+    if cache_name:
+        payload = {"cachedContent": cache_name, "contents": build_contents(messages, None, max_turns)}
+    else:
+        payload = {"contents": build_contents(messages, system_prompt, max_turns)}
+    params = {"key": api_key, "alt": "sse"}
+    body, headers = encode_body(payload)
+    path = model_path(model, streaming=True)
+    for attempt in range(RETRY_ATTEMPTS + 1):
+        with CLIENT.stream(
+            "POST", path, params=params, content=body, headers=headers, timeout=httpx.Timeout(120, connect=5)
+        ) as response:
+            if response.status_code in RETRY_STATUSES and attempt < RETRY_ATTEMPTS:
+                time.sleep(RETRY_BACKOFF_SECONDS * 2**attempt)
+                continue
+            if response.is_error:
+                response.read()
+                raise RuntimeError(f"Gemini API error: {response.status_code} {response.text}")
+            yield from _iter_sse_text(response)
+            return
+
+
+def _iter_sse_text(response: httpx.Response) -> Iterator[str]:
+    """Yield the text of each SSE ``data:`` event in a streaming Gemini response."""
+    received = False
+    for line in response.iter_lines():
+        if not line.startswith("data: "):
+            continue
+        data = orjson.loads(line[len("data: ") :])
+        try:
+            candidates = data["candidates"]
+            parts = candidates[0]["content"].get("parts", [])
+        except (KeyError, IndexError) as exc:
+            raise RuntimeError(f"Unexpected Gemini payload: {data}") from exc
+        text = parts[0].get("text", "") if len(parts) == 1 else "".join(part.get("text", "") for part in parts)
+        if text:
+            received = True
+            yield text
+
+    if not received:
+        raise RuntimeError("Unexpected Gemini payload: Empty response received.")
+
+
+@st.cache_resource
+def get_worker_pool() -> ThreadPoolExecutor:
+    """Share one pool of Gemini I/O workers across every session in the process."""
+    return ThreadPoolExecutor(max_workers=WORKER_POOL_SIZE, thread_name_prefix="gemini")
+
+
+def _pump_stream(
+    chunks: Iterator[str], sink: queue.Queue, cancel: threading.Event, ctx: ScriptRunContext | None
+) -> None:
+    """Drain ``chunks`` into ``sink`` on a pool worker until done or cancelled."""
+    thread = threading.current_thread()
+    # Pool threads are reused, so attach the submitting session's context per task.
+    add_script_run_ctx(thread, ctx)
+    try:
+        # Skip the request entirely if the caller gave up while this task was queued.
+        if cancel.is_set():
+            return
+        for chunk in chunks:
+            if cancel.is_set():
+                break
+            sink.put(chunk)
+    except Exception as exc:  # noqa: BLE001
+        sink.put(exc)
+    finally:
+        # Closing the generator exits the CLIENT.stream context and drops the connection.
+        chunks.close()
+        sink.put(_STREAM_DONE)
+        # add_script_run_ctx(thread, None) would re-attach the current ctx, so clear it directly.
+        setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+
+
+def generate_response(
+    messages: List[Dict[str, str]],
+    system_prompt: str,
+    max_turns: int = MAX_TURNS,
+    model: str = API_MODEL,
+    on_wait: Callable[[float], None] | None = None,
+    on_first_chunk: Callable[[], None] | None = None,
+) -> Iterator[str]:
+    """Stream the Gemini reply, keeping network I/O off the script thread.
+
+    ``on_wait`` is called with the elapsed seconds while no text has arrived yet,
+    and ``on_first_chunk`` just before the first text is yielded. Closing the
+    generator (e.g. when Streamlit starts a new rerun) cancels the worker.
+    """
+    api_key = get_api_key()
+    if not api_key:
+        raise RuntimeError("API 키가 설정되지 않았습니다. 사이드바에서 입력하거나 .env 파일을 업데이트하세요.")
+
+    reply_cache = get_reply_cache()
+    cache_key: ReplyKey = (
+        tuple((message["role"], message["content"]) for message in messages),
+        system_prompt,
+        max_turns,
+        model,
+        hash_api_key(api_key),
+    )
+    cached_reply = reply_cache.get(cache_key)
+    if cached_reply is not None:
+        if on_first_chunk is not None:
+            on_first_chunk()
+        yield cached_reply
+        return
+
+    sink: queue.Queue = queue.Queue()
+    cancel = threading.Event()
+    get_worker_pool().submit(
+        _pump_stream,
+        _stream_gemini(messages, system_prompt, api_key, max_turns, model),
+        sink,
+        cancel,
+        get_script_run_ctx(),
+    )
+    started = time.monotonic()
+    chunks: List[str] = []
+    try:
+        while True:
+            try:
+                item = sink.get(timeout=WAIT_POLL_SECONDS)
+            except queue.Empty:
+                if chunks:
+                    # Once text is flowing, httpx's read timeout covers a stalled stream.
+                    continue
+                elapsed = time.monotonic() - started
+                if elapsed > STREAM_DEADLINE_SECONDS:
+                    raise RuntimeError("Gemini 응답 시간이 초과되었습니다. 잠시 후 다시 시도하세요.") from None
+                if on_wait is not None:
+                    on_wait(elapsed)
+                continue
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if not chunks and on_first_chunk is not None:
+                on_first_chunk()
+            chunks.append(item)
+            yield item
+    finally:
+        cancel.set()
+    reply_cache.put(cache_key, "".join(chunks))
@@ -0,0 +1,37 @@
+import os
+
+from chat_store import _xsrf_token
+
+
+def _mask(token: bytes, mask: bytes) -> bytes:
+    return bytes(byte ^ mask[i % len(mask)] for i, byte in enumerate(token))
+
+
+def _v2_cookie(token: bytes, mask: bytes) -> str:
+    return f"2|{mask.hex()}|{_mask(token, mask).hex()}|1700000000"
+
+
+def test_v2_cookie_unmasks_to_token():
+    token = os.urandom(16)
+    assert _xsrf_token(_v2_cookie(token, b"\x01\x02\x03\x04")) == token
+
+
+def test_v2_cookie_is_stable_across_masks():
+    token = os.urandom(16)
+    assert _xsrf_token(_v2_cookie(token, b"\xaa\xbb\xcc\xdd")) == _xsrf_token(_v2_cookie(token, b"\x10\x20\x30\x40"))
+
+
+def test_v1_hex_cookie():
+    assert _xsrf_token("deadbeef") == bytes.fromhex("deadbeef")
+
+
+def test_quoted_cookie():
+    token = os.urandom(16)
+    assert _xsrf_token(f'"{_v2_cookie(token, b"1234")}"') == token
+
+
+def test_malformed_cookies_yield_no_token():
+    assert _xsrf_token("") == b""
+    assert _xsrf_token("not-hex") == b""
+    assert _xsrf_token("2|zz|yy|1") == b""
+    assert _xsrf_token("2|abcd|ef") == b""
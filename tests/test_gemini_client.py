@@ -0,0 +1,41 @@
+import pytest
+
+from gemini_client import build_contents
+
+
+def _history(length):
+    # Greeting first, then alternating user/assistant turns.
+    return [{"role": "assistant" if i % 2 == 0 else "user", "content": str(i)} for i in range(length)]
+
+
+def _texts(contents):
+    return [entry["parts"][0]["text"] for entry in contents]
+
+
+def test_short_history_is_sent_in_full_after_system_prompt():
+    contents = build_contents(_history(4), "SYS", max_turns=12)
+    assert _texts(contents) == ["SYS", "0", "1", "2", "3"]
+    assert [entry["role"] for entry in contents] == ["user", "model", "user", "model", "user"]
+
+
+def test_no_system_entry_when_prompt_is_cached():
+    assert _texts(build_contents(_history(3), None, max_turns=12)) == ["0", "1", "2"]
+
+
+def test_long_history_keeps_greeting_and_recent_window():
+    contents = build_contents(_history(20), None, max_turns=5)
+    assert _texts(contents) == ["0", "15", "16", "17", "18", "19"]
+
+
+def test_window_drops_leading_assistant_turn():
+    # With an even window ending on a user turn the raw window would open on an assistant message.
+    contents = build_contents(_history(20), "SYS", max_turns=12)
+    assert _texts(contents)[:3] == ["SYS", "0", "9"]
+    assert len(contents) == 1 + 1 + 11
+
+
+@pytest.mark.parametrize("length", range(1, 30))
+@pytest.mark.parametrize("max_turns", [2, 3, 12, 13])
+def test_roles_always_alternate(length, max_turns):
+    roles = [entry["role"] for entry in build_contents(_history(length), "SYS", max_turns)]
+    assert all(previous != current for previous, current in zip(roles, roles[1:]))